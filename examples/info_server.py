@@ -2,19 +2,51 @@
 
 
 from __future__ import print_function
+
+# Make all blocking standard-library calls (sockets, DNS resolution, select, ...) cooperative before anything else
+# gets to import them, so that nothing in the process can stall the event loop serving the pollers.
+from gevent import monkey
+monkey.patch_all()
+
 import gevent.hub
 from gevent.event import AsyncResult
+from gevent.pywsgi import WSGIServer
 
 import redis_info_provider
 import argparse
-from threading import Thread
 
 try:
     import xmlrpclib
-    from SimpleXMLRPCServer import SimpleXMLRPCServer
+    from SimpleXMLRPCServer import SimpleXMLRPCDispatcher
 except ImportError:
     import xmlrpc.client as xmlrpclib
-    from xmlrpc.server import SimpleXMLRPCServer
+    from xmlrpc.server import SimpleXMLRPCDispatcher
+
+
+def dump_i8(_, value, write):
+    """
+    Marshaller dispatch function serializing integers as i8 (64-bits). Called for every integer INFO value in
+    a response, so it writes the whole element with a single %-format.
+    """
+    write('<value><i8>%d</i8></value>' % value)
+
+
+def make_xmlrpc_app(dispatcher):
+    """
+    Wraps an XML-RPC dispatcher as a WSGI application, so that it can be served by gevent in the same event loop
+    as the shard pollers, rather than by a threaded server competing with them over the GIL.
+    """
+    def app(environ, start_response):
+        if environ['REQUEST_METHOD'] != 'POST':
+            start_response('405 Method Not Allowed', [('Allow', 'POST')])
+            return [b'']
+
+        data = environ['wsgi.input'].read(int(environ.get('CONTENT_LENGTH') or 0))
+        response = dispatcher._marshaled_dispatch(data)
+        start_response('200 OK', [('Content-Type', 'text/xml'), ('Content-Length', str(len(response)))])
+        return [response]
+
+    return app
 
 
 def main():
@@ -37,15 +69,16 @@ def main():
     # prevent KeyboardInterrupt thrown in a greenlet from causing a stack trace to be printed
     gevent.hub.Hub.NOT_ERROR = (KeyboardInterrupt,)
 
-    # Python's xmlrpc module serializes integers as i4 (32-bits) out of the box. This line causes all ints to
-    # be serialized as i8 (64-bits), as some Redis INFO values require the additional space.
-    xmlrpclib.Marshaller.dispatch[int] = lambda _, value, write: write('<value><i8>{}</i8></value>'.format(value))
+    # Python's xmlrpc module serializes integers as i4 (32-bits) out of the box. This causes all ints to be
+    # serialized as i8 (64-bits), as some Redis INFO values require the additional space.
+    xmlrpclib.Marshaller.dispatch[int] = dump_i8
 
     print('Starting INFO server on {}:{}...'.format(args.address, args.port))
 
-    server = SimpleXMLRPCServer((args.address, args.port))
-    server.register_instance(redis_info_provider.InfoProviderServicer())
-    Thread(target=server.serve_forever).start()
+    dispatcher = SimpleXMLRPCDispatcher(allow_none=False, encoding=None)
+    dispatcher.register_instance(redis_info_provider.InfoProviderServicer())
+    server = WSGIServer((args.address, args.port), make_xmlrpc_app(dispatcher), log=None)
+    server.start()
 
     try:
         with redis_info_provider.LocalShardWatcher() as watcher , redis_info_provider.InfoPoller() as poller:
@@ -60,8 +93,7 @@ def main():
         print(f'INFO server caught exception:{e}')
     finally:
         print('INFO server shutting.')
-        server.shutdown()
-        server.server_close()
+        server.stop()
 
 
 if __name__ == '__main__':
@@ -19,7 +19,6 @@ if sys.version_info[:2] < (3, 4):
     install_requires.append('enum')
 
 tests_require = [
-    'six',
     'mock',
 ]
 
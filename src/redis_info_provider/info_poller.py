@@ -125,6 +125,8 @@ class InfoPoller(object):
         # least terminate the greenlet.
         while True:
             try:
+                # Re-read on every (re)connect, so a watcher may replace the shard's connection (or
+                # connection factory) and have it picked up after the next Redis error
                 redis_conn = (shard.redis_conn() if
                               callable(shard.redis_conn) else
                               shard.redis_conn)
@@ -133,7 +135,6 @@ class InfoPoller(object):
                 while True:
                     info = redis_conn.info('everything')
                     self.logger.debug('Polled shard %s', shard.id)
-                    info['meta'] = {}
                     shard.info = info
                     consecutive_redis_failures = 0; consecutive_general_failures = 0
                     gevent.sleep(shard.polling_interval())
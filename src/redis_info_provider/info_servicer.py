@@ -1,11 +1,11 @@
 from __future__ import print_function
-import time
+from time import time
 import functools
 import warnings
 from .shard_pub import ShardPublisher
 from .redis_shard import InfoType, RedisShard
 import logging
-from typing import List, Sequence, AbstractSet
+from typing import List, Iterable, Optional, Sequence, AbstractSet, FrozenSet, Tuple, Union
 
 
 logger = logging.getLogger(__name__)
@@ -45,9 +45,13 @@ def rename_kwargs(func_name, kwargs, aliases):
 class InfoProviderServicer(object):
     """Implements the InfoProvider RPC interface."""
 
+    #: Maximum number of filtered INFO views cached per shard. Filters are client-controlled, and
+    #: a shard that isn't being re-polled never has its cache reset, so the cache must be bounded.
+    FILTERED_INFO_CACHE_SIZE = 16
+
     @classmethod
     def _filter_info(cls, full_info, keys, prefix_matching=False):
-        # type: (InfoType, AbstractSet[str]) -> InfoType
+        # type: (InfoType, AbstractSet[str], bool) -> InfoType
 
         """
         Returns a filtered view of `full_info` according to the key-list specified in
@@ -55,51 +59,110 @@ class InfoProviderServicer(object):
         of keys.
 
         :param full_info: An info_pb2.Info instance to filter.
-        :param keys: A set of strings to match for.
+        :param keys: A set of strings to match for. (When prefix matching, preferably the
+            tuple returned by _reduce_prefixes.)
         :param prefix_matching: If True, we treat each key in `keys` as a prefix of a
             field in `full_info`
         """
 
-        def is_matching_key(full_key, keys, prefix_matching=False):
-            if not prefix_matching:
-                return full_key in keys
-            else:
-                if full_key.startswith(tuple(keys)):
-                    return True
-                return False
-
         # Optimization: If no keys specified, just return the full info that's already waiting
         if not keys:
             return full_info
 
-        info = {k: full_info[k] for k in full_info if is_matching_key(k, keys, prefix_matching=prefix_matching)}
-        # always include the metadata
-        info['meta'] = full_info['meta']
+        if prefix_matching:
+            # str.startswith() accepts a tuple and tests all prefixes in a single call
+            prefixes = tuple(keys)
+            info = {k: full_info[k] for k in full_info if k.startswith(prefixes)}
+        else:
+            # Clients typically ask for a handful of the INFO fields, so walk the requested keys
+            # rather than the full INFO
+            info = {k: full_info[k] for k in keys if k in full_info}
+
+        # always include any metadata the shard's INFO carries
+        if 'meta' in full_info:
+            info['meta'] = full_info['meta']
+
+        return info
+
+    @classmethod
+    def _get_filtered_info(cls, shard, keys, prefix_matching=False):
+        # type: (RedisShard, Union[FrozenSet[str], Tuple[str, ...]], bool) -> InfoType
 
+        """
+        Returns the INFO of `shard` filtered as by `_filter_info`. A shard's INFO only changes
+        when it is re-polled, so the filtered result is cached on the shard and reused by further
+        requests for the same keys until then, up to FILTERED_INFO_CACHE_SIZE distinct filters.
+        Each cache entry holds the INFO it was filtered from, and is only reused while that is still
+        the shard's INFO, however the INFO gets replaced.
+        """
+        if not keys:
+            return shard.info
+
+        full_info = shard.info
+        cache = shard._filtered_info_cache
+        cache_key = (keys, prefix_matching)
+        entry = cache.get(cache_key)
+        if entry is not None and entry[0] is full_info:
+            return entry[1]
+
+        info = cls._filter_info(full_info=full_info, keys=keys, prefix_matching=prefix_matching)
+        if entry is not None or len(cache) >= cls.FILTERED_INFO_CACHE_SIZE:
+            # Either the INFO was replaced since it was cached, so all entries are stale, or the cache is full.
+            # Start over rather than track usage; clients normally repeat only a few filters.
+            cache.clear()
+        cache[cache_key] = (full_info, info)
         return info
 
     @staticmethod
-    def _get_shard_with_info(shard_id):
-        # type: (str) -> RedisShard
+    def _reduce_prefixes(prefixes):
+        # type: (Iterable[str]) -> Tuple[str, ...]
 
         """
-        Gets the shard object from the ShardPublisher if it contains valid INFO, or raises an
-        appropriate exception otherwise.
+        Returns the minimal tuple of prefixes matching the same keys as `prefixes`, i.e. without
+        any prefix that is itself covered by a shorter one (e.g. 'db0' is dropped if 'db' is
+        present). Clients tend to send many overlapping prefixes, and every prefix kept here is
+        tested against every INFO field of every queried shard.
+        """
+        result = []
+        # In sorted order, all strings starting with a given prefix immediately follow it, so
+        # each candidate only needs to be checked against the last prefix we kept
+        for prefix in sorted(prefixes):
+            if not result or not prefix.startswith(result[-1]):
+                result.append(prefix)
+        return tuple(result)
+
+    @staticmethod
+    def _unknown_shard_error(shard_id):
+        # type: (str) -> str
+
+        """
+        Logs a request for the unknown shard `shard_id`, and returns the error describing it.
+        """
+        logger.warning('received request for unknown shard (%s)', shard_id)
+        return 'shard {} not found'.format(shard_id)
+
+    @classmethod
+    def _try_get_shard_with_info(cls, shard_id):
+        # type: (str) -> Tuple[Optional[RedisShard], Optional[str]]
+
+        """
+        Gets the shard object from the ShardPublisher if it contains valid INFO. Missing shards
+        are an expected condition for `allow_partial` requests, so this reports them via the
+        return value rather than by raising.
         :param shard_id: The identifier of the shard.
-        :return: The shard object for shard 'shard_id'.
+        :return: A (shard, None) tuple with the shard object for shard 'shard_id', or a
+            (None, error) tuple describing why it is unavailable.
         """
 
-        try:
-            shard = ShardPublisher.get_shard(shard_id)
-        except KeyError:
-            logger.warning('received request for unknown shard (%s)', shard_id)
-            raise KeyError('shard {} not found'.format(shard_id))
+        shard = ShardPublisher.try_get_shard(shard_id)
+        if shard is None:
+            return None, cls._unknown_shard_error(shard_id)
 
         if shard.info is None:
             logger.warning('received request for shard (%s) which seems to have not yet been polled', shard_id)
-            raise KeyError('info for shard {} not available'.format(shard_id))
+            return None, 'info for shard {} not available'.format(shard_id)
 
-        return shard
+        return shard, None
 
     @deprecated_alias(key_patterns='keys')
     def GetInfos(self, shard_ids=(), keys=(), allow_partial=False, max_age=0.0, prefix_matching=False):
@@ -114,12 +177,15 @@ class InfoProviderServicer(object):
             shards will be returned.
         :param keys: List of exact-match keys to filter for. If not empty, only
             keys that are in this list will appear in the response INFOs.
-            (Plus the 'meta' key that is always present.)
+            (Plus the 'meta' key that is always present, and that also carries any
+            'meta' entries from the shard's INFO.)
         :param allow_partial: If True, and a requested shard is missing or cannot
             be queried, a response will still be returned, with the info_age for that
             shard set to a very large value (>> century), and an additional 'error'
             string in the meta dictionary. If False (the default), the same condition
-            will raise an exception.
+            will raise an exception. Unknown shards are reported first: the exception
+            names the first unknown shard requested, if any, and otherwise the first
+            requested shard whose INFO is not yet available.
         :param max_age: If specified and non-zero, only shard infos whose age is less-
             than-or-equal-to max_age will be returned in the response.
         :param prefix_matching: If True, we treat each key in `keys` as a prefix of a
@@ -130,32 +196,59 @@ class InfoProviderServicer(object):
 
         logger.debug('Received request for shards %s, keys %s', shard_ids, keys)
 
-        shards_to_query = (
-                shard_ids or
-                # If all shards were requested, only consider the live ones that have already been polled at least once
-                [shard.id for shard in ShardPublisher.get_live_shards() if shard.info]
-        )
-
-        for shard_id in shards_to_query:
-            try:
-                shard = self._get_shard_with_info(shard_id)
-                info_age = time.time() - shard.info_timestamp
+        if shard_ids and not allow_partial:
+            # Unknown shards fail the whole request, so check for them up front, before building any of the
+            # response. Missing INFO is still only detected per shard, below.
+            missing_ids = set(shard_ids).difference(ShardPublisher.get_live_shard_ids())
+            if missing_ids:
+                missing_id = next(shard_id for shard_id in shard_ids if shard_id in missing_ids)
+                raise KeyError(self._unknown_shard_error(missing_id))
+
+        # The same key filter applies to all shards, so prepare it once. Both forms are hashable, for
+        # use as a cache key, and the reduced prefixes are canonical, so equivalent requests share it.
+        key_set = self._reduce_prefixes(keys) if prefix_matching else frozenset(keys)
+        # All shards in a response are aged relative to the same point in time
+        now = time()
+        # Bind the methods called for every shard locally, sparing an attribute lookup per iteration
+        try_get_shard_with_info = self._try_get_shard_with_info
+        get_filtered_info = self._get_filtered_info
+        append_msg = resp.append
+
+        # (shard_id, shard, error) lookup results for each shard to be queried
+        if shard_ids:
+            shards_to_query = ((shard_id,) + try_get_shard_with_info(shard_id) for shard_id in shard_ids)
+        else:
+            # If all shards were requested, only consider the live ones that have already been polled at least
+            # once. We already hold the shard objects, so there's no need to look them up again by id.
+            shards_to_query = ((shard.id, shard, None) for shard in ShardPublisher.get_live_shards() if shard.info)
+
+        for shard_id, shard, error in shards_to_query:
+            if shard is not None:
+                info_age = now - shard.info_timestamp
                 if max_age and info_age > max_age:
                     logger.debug('Shard %s info age %s > %s (max-age); Skipping', shard_id, info_age, max_age)
                     continue
-                msg = self._filter_info(full_info=shard.info, keys=set(keys), prefix_matching=prefix_matching)
-                msg['meta']['info_age'] = info_age
-            except KeyError as e:
-                if allow_partial:
-                    msg = {'meta': {
-                        'info_age': 1e38,  # Very large, but still fits in a single-precision float
-                        'error': str(e).strip('\'"'),  # str() for KeyError adds extra quotes that we don't want
-                    }}
+                # Unfiltered requests are the common case; skip the filtering call for them altogether
+                if key_set:
+                    info = get_filtered_info(shard, keys=key_set, prefix_matching=prefix_matching)
                 else:
-                    raise
+                    info = shard.info
+                # The INFO is shared with the shard and with concurrent responses, so each response is
+                # a shallow copy of it, with its own copy of any metadata the shard INFO carries
+                msg = dict(info)
+                meta = dict(info.get('meta') or ())
+                meta['info_age'] = info_age
+                msg['meta'] = meta
+            elif allow_partial:
+                msg = {'meta': {
+                    'info_age': 1e38,  # Very large, but still fits in a single-precision float
+                    'error': error,
+                }}
+            else:
+                raise KeyError(error)
 
             msg['meta']['shard_identifier'] = shard_id
 
-            resp.append(msg)
+            append_msg(msg)
 
         return resp
@@ -83,9 +83,8 @@ class LocalShardWatcher(object):
 
                 logger.info('Updated Redis shards: %s', live_shard_ids)
 
-                for shard_id in live_shard_ids - published_shard_ids:
-                    # New shard
-                    ShardPublisher.add_shard(live_shards[shard_id])
+                # New shards
+                ShardPublisher.add_shards(live_shards[shard_id] for shard_id in live_shard_ids - published_shard_ids)
                 for shard_id in published_shard_ids - live_shard_ids:
                     # Removed shard
                     ShardPublisher.del_shard(shard_id)
@@ -104,9 +103,18 @@ class LocalShardWatcher(object):
         """
         Get an identifier --> RedisShard dictionary of redis-server processes on the system. PID
         is used as the unique identifier of a Redis instance.
+        Processes already published to the ShardPublisher are returned as their published RedisShard
+        objects, without re-examining their connections, which is by far the costliest part of the
+        scan. Consequently, a published shard stays live for as long as its redis-server process is
+        running, even if it stops listening or its connections can no longer be examined.
         """
         result = {}
         for redis_proc in cls._get_running_redises():
+            shard = ShardPublisher.try_get_shard(str(redis_proc.pid))
+            if shard is not None:
+                result[shard.id] = shard
+                continue
+
             kwargs = cls._get_connection_kwargs(redis_proc)
             if kwargs is not None:
                 conn_maker = lambda _kwargs=kwargs: redis.StrictRedis(**_kwargs)
@@ -152,10 +160,12 @@ class LocalShardWatcher(object):
         the local machine.
         """
 
+        # process_iter() already reads the requested attrs into p.info (in one batch per process, and
+        # skipping processes that disappear meanwhile); calling p.name() again would re-read /proc for
+        # every process on the machine. Processes that can't be inspected get a None name.
+        #
+        # Classification isn't cached across scans by PID: a process may exec() into redis-server after
+        # we've first seen it.
         for p in psutil.process_iter(attrs=['pid', 'name']):
-            try:
-                if p.name() == 'redis-server':
-                    yield p
-            except psutil.Error:
-                # Process may have been closed suddenly, or some other problem with process-inspection
-                pass
+            if p.info['name'] == 'redis-server':
+                yield p
@@ -1,5 +1,5 @@
 import logging
-from typing import Union, Callable, Dict, Any
+from typing import Union, Callable, Dict, Any, Optional, Tuple
 import redis
 import time
 
@@ -15,6 +15,10 @@ class RedisShard(object):
     Encapsulates all per-shard data and logic.
     """
 
+    # There's one instance per shard, accessed on every poll and every query; slots keep instances
+    # small and attribute access cheap. (Subclasses may still add attributes freely.)
+    __slots__ = ('id', 'redis_conn', '_info', 'info_timestamp', '_filtered_info_cache', '_interval')
+
     #: Minimum polling interval permitted, in seconds
     MIN_POLLING_INTERVAL = 0.5
 
@@ -49,9 +53,14 @@ class RedisShard(object):
 
         #: An instance of redis.StrictRedis or its subclass that provides an open
         #: connection to this shard, OR a callable that, when called, returns such an
-        #: instance.
+        #: instance. May be replaced at any time; the poller uses the new value when it
+        #: next (re)connects.
         self.redis_conn = redis_conn
 
+        #: Filtered views of the INFO, keyed by filter specification, each stored along with the INFO
+        #: it was derived from. Maintained by the InfoProviderServicer.
+        self._filtered_info_cache = {}  # type: Dict[Any, Tuple[InfoType, InfoType]]
+
         #: The latest available INFO for this shard, as a dictionary
         self.info = None
 
@@ -79,8 +88,23 @@ class RedisShard(object):
     @info.setter
     def info(self, value):
         # type: (InfoType) -> None
+        self.set_info(value)
+
+    def set_info(self, value, timestamp=None):
+        # type: (InfoType, Optional[float]) -> None
+
+        """
+        Update the info for this shard. Assigning to RedisShard.info is equivalent to calling
+        this with the default timestamp.
+        :param value: The new info.
+        :param timestamp: Timestamp (as returned by time.time()) at which the info was obtained.
+            Defaults to the current time.
+        """
         self._info = value
-        self.info_timestamp = time.time()
+        self.info_timestamp = time.time() if timestamp is None else timestamp
+        # views filtered from the previous info are stale; drop them, and the reference to it they hold
+        if self._filtered_info_cache:
+            self._filtered_info_cache.clear()
         self._update_interval()
 
     def _update_interval(self):
@@ -91,11 +115,14 @@ class RedisShard(object):
         in the latest info.
         """
 
-        if self.info is None:
+        # read the backing field directly; this runs on every poll, and going through the `info`
+        # property would cost an extra Python-level call each time
+        info = self._info
+        if info is None:
             # no info to use yet
             return
 
-        ops_sec = self.info['instantaneous_ops_per_sec']
+        ops_sec = info['instantaneous_ops_per_sec']
 
         if ops_sec >= self.OPS_ACTIVE_THRESH:
             # shard was active; immediately drop to frequent polling
@@ -108,11 +135,7 @@ class RedisShard(object):
         self._interval = max(self.MIN_POLLING_INTERVAL, min(self.MAX_POLLING_INTERVAL, self._interval))
 
     def __str__(self):
-        return 'Shard<{}>'.format(self.id)
+        return 'Shard<%s>' % self.id
 
     def __repr__(self):
-        return '{class_name}({id}, {conn})'.format(
-            class_name=self.__class__.__name__,
-            id=self.id,
-            conn=self.redis_conn
-        )
+        return '%s(%s, %s)' % (self.__class__.__name__, self.id, self.redis_conn)
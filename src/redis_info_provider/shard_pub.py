@@ -1,7 +1,9 @@
+import contextlib
 import logging
+from collections import OrderedDict
 from enum import Enum
 from .redis_shard import RedisShard
-from typing import List, Set, Callable
+from typing import Dict, FrozenSet, Iterable, Iterator, MutableMapping, Optional, Sequence, Callable
 
 
 logger = logging.getLogger(__name__)
@@ -21,26 +23,33 @@ class _ShardPublisher(object):
     """
 
     def __init__(self):
-        self._subs_new = []
-        self._subs_del = []
+        self._subscribers = self._make_subscriber_registry()
         self._shards = {}
+        self._live_shards = None
+        self._live_shard_ids = None
 
     def get_live_shards(self):
-        # type: () -> List[RedisShard]
+        # type: () -> Sequence[RedisShard]
 
-        """Return all live shards in the system, as a list of RedisShard objects.
+        """Return all live shards in the system, as a tuple of RedisShard objects.
         The returned objects may be updated and changed as required; all changes will be
         reflected in further calls to methods of this class.
         """
-        return self._shards.values()
+        # The tuple is only rebuilt after shards are added or removed
+        if self._live_shards is None:
+            self._live_shards = tuple(self._shards.values())
+        return self._live_shards
 
     def get_live_shard_ids(self):
-        # type: () -> Set[str]
+        # type: () -> FrozenSet[str]
 
         """
-        Return identifiers of all live shards in the system, as a set of strings.
+        Return identifiers of all live shards in the system, as a frozenset of strings.
         """
-        return set(self._shards.keys())
+        # Like get_live_shards(), this is a snapshot only rebuilt after shards are added or removed
+        if self._live_shard_ids is None:
+            self._live_shard_ids = frozenset(self._shards)
+        return self._live_shard_ids
 
     def get_shard(self, identifier):
         # type: (str) -> RedisShard
@@ -50,29 +59,20 @@ class _ShardPublisher(object):
         """
         return self._shards[identifier]
 
+    def try_get_shard(self, identifier):
+        # type: (str) -> Optional[RedisShard]
+
+        """
+        Return Shard object corresponding to the provided identifier, or None if there is no
+        such live shard.
+        """
+        return self._shards.get(identifier)
+
     class ShardEvent(Enum):
         """Describes a type of shard-related event."""
         ADDED = 1
         REMOVED = 2
 
-        @classmethod
-        def select_event_list(cls, pub, event):
-            # type: (_ShardPublisher, _ShardPublisher.ShardEvent) -> List[EventTarget]
-
-            """
-            Selects the appropriate event subscriber list from ShardPublisher.
-            Don't call this outside ShardPublisher!
-            :param pub: A ShardPublisher instance.
-            :param event: The event type.
-            :return: Reference to the appropriate subscriber list in `pub`.
-            """
-            if event == cls.ADDED:
-                return pub._subs_new
-            elif event == cls.REMOVED:
-                return pub._subs_del
-            else:
-                raise KeyError('unknown event type {}'.format(event))
-
     def subscribe_shard_event(self, event, target):
         # type: (ShardEvent, EventTarget) -> None
 
@@ -80,9 +80,10 @@ class _ShardPublisher(object):
         Add a subscriber to be notified of shard events.
         :param event: A ShardEvent specifying the type of event to subscribe to.
         :param target: The subscriber. When a shard event occurs, `target` will be
-            called with the RedisShard instance.
+            called with the RedisShard instance. Subscribing the same target to the
+            same event more than once has no further effect.
         """
-        self.ShardEvent.select_event_list(self, event).append(target)
+        self._subscribers[event][target] = None
 
     def unsub_shard_event(self, event, target):
         # type: (ShardEvent, EventTarget) -> None
@@ -93,7 +94,27 @@ class _ShardPublisher(object):
         :param target: The subscriber. It is an error for this to not be a current
             subscriber to that event type.
         """
-        self.ShardEvent.select_event_list(self, event).remove(target)
+        del self._subscribers[event][target]
+
+    @classmethod
+    def _make_subscriber_registry(cls):
+        # type: () -> Dict[ShardEvent, MutableMapping[EventTarget, None]]
+
+        """
+        Returns a new, empty, event type --> subscribers registry. Subscribers are kept as the keys
+        of an OrderedDict, which acts as an ordered set: unsubscribing is O(1), while subscribers
+        are still notified in the order they subscribed.
+        """
+        return {event: OrderedDict() for event in cls.ShardEvent}
+
+    def _shards_changed(self):
+        # type: () -> None
+
+        """
+        Discard the live shard snapshots; to be called whenever the set of tracked shards changes.
+        """
+        self._live_shards = None
+        self._live_shard_ids = None
 
     def clear_shards(self):
         # type: () -> None
@@ -102,6 +123,36 @@ class _ShardPublisher(object):
         Remove all tracked shards.
         """
         self._shards.clear()
+        self._shards_changed()
+
+    def _reset_state(self):
+        # type: () -> None
+
+        """
+        Remove all tracked shards and all event subscribers, restoring the initial state in place.
+        Meant for isolating tests from one another.
+        """
+        self.clear_shards()
+        for subscribers in self._subscribers.values():
+            subscribers.clear()
+
+    @contextlib.contextmanager
+    def isolated_state(self):
+        # type: () -> Iterator[_ShardPublisher]
+
+        """
+        Context manager that runs its body against empty shard and subscriber registries, and
+        restores the previous ones on exit. Meant for isolating tests from one another.
+        """
+        saved_state = self._shards, self._subscribers
+        self._shards = {}
+        self._subscribers = self._make_subscriber_registry()
+        self._shards_changed()
+        try:
+            yield self
+        finally:
+            self._shards, self._subscribers = saved_state
+            self._shards_changed()
 
     def add_shard(self, shard):
         # type: (RedisShard) -> None
@@ -113,9 +164,33 @@ class _ShardPublisher(object):
         """
         logger.info('Adding shard %s', shard.id)
         self._shards[shard.id] = shard
-        for tgt in self._subs_new:
+        self._shards_changed()
+        # iterate over a snapshot, so subscribers may (un)subscribe while being notified
+        for tgt in tuple(self._subscribers[self.ShardEvent.ADDED]):
             tgt(shard)
 
+    def add_shards(self, shards):
+        # type: (Iterable[RedisShard]) -> None
+
+        """
+        Notify the publisher multiple new shards have been added to the system. Equivalent to
+        calling add_shard() for each shard, except that all shards are registered before
+        subscribers are notified of any of them. This is an interface for use by shard watcher
+        implementations.
+        :param shards: An iterable of RedisShard instances.
+        """
+        new_shards = {shard.id: shard for shard in shards}
+        if not new_shards:
+            return
+
+        logger.info('Adding shards %s', ', '.join(new_shards))
+        self._shards.update(new_shards)
+        self._shards_changed()
+        subscribers = tuple(self._subscribers[self.ShardEvent.ADDED])
+        for shard in new_shards.values():
+            for tgt in subscribers:
+                tgt(shard)
+
     def del_shard(self, shard_id):
         # type: (str) -> None
 
@@ -126,7 +201,9 @@ class _ShardPublisher(object):
         """
         logger.info('Deleting shard %s', shard_id)
         shard = self._shards.pop(shard_id)
-        for tgt in self._subs_del:
+        self._shards_changed()
+        # iterate over a snapshot, so subscribers may (un)subscribe while being notified
+        for tgt in tuple(self._subscribers[self.ShardEvent.REMOVED]):
             tgt(shard)
 
 
@@ -1,7 +1,8 @@
 from unittest import TestCase
+from collections import Counter
 from mock import NonCallableMock, patch
 import gevent
-import six
+import redis
 from redis_info_provider import *
 
 
@@ -42,9 +43,7 @@ class TestInfoPoller(TestCase):
             actual_registered_callbacks = [
                 call_args[0] for call_args in self._mockPublisher.subscribe_shard_event.call_args_list
             ]
-            six.assertCountEqual(self,
-                                 expected_registered_callbacks,
-                                 actual_registered_callbacks)
+            self.assertEqual(Counter(expected_registered_callbacks), Counter(actual_registered_callbacks))
 
     def test_poll(self):
         shard = self.NoDelayShard(1, self._mockStrictRedis(port=6379))
@@ -52,15 +51,13 @@ class TestInfoPoller(TestCase):
         with InfoPoller() as poller:
             poller._add_shard(shard)
             gevent.sleep(0)  # yield so the poller polls
-            six.assertCountEqual(
-                self,
+            self.assertEqual(
                 (6379, self._tick),
                 (shard.info['port'], shard.info['tick'])
             )
             self._tick += 1
             gevent.sleep(0)  # yield so the poller polls
-            six.assertCountEqual(
-                self,
+            self.assertEqual(
                 (6379, self._tick),
                 (shard.info['port'], shard.info['tick'])
             )
@@ -71,8 +68,7 @@ class TestInfoPoller(TestCase):
         poller = InfoPoller()
         poller._add_shard(shard)
         gevent.sleep(0)  # yield so the poller polls
-        six.assertCountEqual(
-            self,
+        self.assertEqual(
             (6379, self._tick),
             (shard.info['port'], shard.info['tick'])
         )
@@ -82,12 +78,37 @@ class TestInfoPoller(TestCase):
 
         self._tick += 1
         gevent.sleep(0)  # yield so the poller has a chance to poll (it shouldn't)
-        six.assertCountEqual(
-            self,
+        self.assertEqual(
             (6379, 1),
             (shard.info['port'], shard.info['tick'])
         )
 
+    def test_stop_during_backoff(self):
+        # a shard whose polling always fails with a non-Redis error, so the poller waits before retrying
+        shard = self.NoDelayShard(1, NonCallableMock(**{'info.side_effect': ValueError('boom')}))
+
+        poller = InfoPoller()
+        poller._add_shard(shard)
+        gevent.sleep(0)  # yield so the poller polls, fails and starts waiting
+
+        # killing the greenlet interrupts its wait, so stopping must not block for the retry interval
+        with gevent.Timeout(0.5):
+            poller.stop()
+
+    def test_reconnect_uses_current_connection(self):
+        # a shard whose connection is down, so the poller backs off and reconnects
+        shard = self.NoDelayShard(1, NonCallableMock(**{'info.side_effect': redis.ConnectionError()}))
+
+        with InfoPoller() as poller:
+            poller._add_shard(shard)
+            gevent.sleep(0)  # yield so the poller polls, fails and starts waiting
+            self.assertIsNone(shard.info)
+
+            # the watcher replaces the shard's connection; the poller should use it once it reconnects
+            shard.redis_conn = lambda: self._mockStrictRedis(port=6380)
+            gevent.sleep(1.1)  # outlast the poller's cool-off period after a Redis error
+            self.assertEqual(6380, shard.info['port'])
+
     # RedisShard that specifies no delay between consecutive pollings
     class NoDelayShard(RedisShard):
         def polling_interval(self): return 0.0
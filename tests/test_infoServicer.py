@@ -1,34 +1,44 @@
 from unittest import TestCase
-import six
+import re
 from redis_info_provider import *
+from redis_info_provider import info_servicer
 from mock import patch
 
 
-class TestInfoServicer(TestCase):
-    CENTURY_IN_SEC = 3.154e9
+# Expected `error` values in the meta of partial responses
+INFO_UNAVAILABLE_RE = re.compile(r'info for shard .* not available')
+SHARD_NOT_FOUND_RE = re.compile(r'shard .* not found')
+
+# Fields added to every test shard's INFO. instantaneous_ops_per_sec is needed in order to set the shard's
+# polling frequency, even though in this case no one will ever poll it...
+BASE_INFO = {'instantaneous_ops_per_sec': 1.0}
 
-    def setUp(self):
-        self.servicer = InfoProviderServicer()
 
-    def tearDown(self):
-        ShardPublisher.clear_shards()
+def make_shard(id, info={}, info_timestamp=None):
+    shard = RedisShard(id, None)
 
-    @staticmethod
-    def make_shard(id, info={}, info_timestamp=None):
-        shard = RedisShard(id, None)
+    if info is not None:
+        # the timestamp defaults to the current time, unless requested otherwise
+        shard.set_info(dict(info, **BASE_INFO), info_timestamp)
+    elif info_timestamp is not None:
+        shard.info_timestamp = info_timestamp
 
-        if info is not None:
-            fixedup_info = dict(info)
-            fixedup_info['meta'] = {}  # this is required to be present, even if empty
-            fixedup_info['instantaneous_ops_per_sec'] = 1.0     # needed in order to set the shard's polling frequency,
-                                                                # even though in this case no one will ever poll it...
-            shard.info = fixedup_info
+    return shard
 
-        # override the timestamp, if requested. (by default this is set to current time when shard.info is set.)
-        if info_timestamp is not None:
-            shard.info_timestamp = info_timestamp
 
-        return shard
+class TestInfoServicer(TestCase):
+    CENTURY_IN_SEC = 3.154e9
+
+    def setUp(self):
+        # run each test against its own, initially empty, publisher state
+        isolation = ShardPublisher.isolated_state()
+        isolation.__enter__()
+        self.addCleanup(isolation.__exit__, None, None, None)
+
+        self.servicer = InfoProviderServicer()
+
+    def assertErrorMatches(self, error, pattern):
+        self.assertIsNotNone(pattern.search(error), msg='%r does not match %r' % (error, pattern.pattern))
 
     def assertSensibleAge(self, info_age, max_age=0.1):
         self.assertLessEqual(0.0, info_age)
@@ -37,8 +47,7 @@ class TestInfoServicer(TestCase):
     def test_query_single(self):
         shard_ids = ['shard-1', 'shard-2', 'shard-3']
 
-        for shard_id in shard_ids:
-            ShardPublisher.add_shard(self.make_shard(shard_id))
+        ShardPublisher.add_shards(make_shard(shard_id) for shard_id in shard_ids)
 
         response = self.servicer.GetInfos([shard_ids[0]])
 
@@ -50,34 +59,34 @@ class TestInfoServicer(TestCase):
         shard_ids = ['shard-1', 'shard-2', 'shard-3', 'shard-4']
         query_ids = ['shard-2', 'shard-3']
 
-        for shard_id in shard_ids:
-            ShardPublisher.add_shard(self.make_shard(shard_id))
+        ShardPublisher.add_shards(make_shard(shard_id) for shard_id in shard_ids)
 
         response = self.servicer.GetInfos(query_ids)
 
-        response_shard_ids = [info['meta']['shard_identifier'] for info in response]
-
-        six.assertCountEqual(self, query_ids, response_shard_ids,
-                             msg='Unexpected or missing shards in response')
-
+        response_shard_ids = []
         for info in response:
-            self.assertSensibleAge(info['meta']['info_age'])
+            meta = info['meta']
+            response_shard_ids.append(meta['shard_identifier'])
+            self.assertSensibleAge(meta['info_age'])
+
+        self.assertEqual(sorted(query_ids), sorted(response_shard_ids),
+                         msg='Unexpected or missing shards in response')
 
     def test_query_all(self):
         shard_ids = ['shard-1', 'shard-2', 'shard-3', 'shard-4']
 
-        for shard_id in shard_ids:
-            ShardPublisher.add_shard(self.make_shard(shard_id))
+        ShardPublisher.add_shards(make_shard(shard_id) for shard_id in shard_ids)
 
         response = self.servicer.GetInfos()
 
-        response_shard_ids = [info['meta']['shard_identifier'] for info in response]
-
-        six.assertCountEqual(self, shard_ids, response_shard_ids,
-                             msg='Unexpected or missing shards in response')
-
+        response_shard_ids = []
         for info in response:
-            self.assertSensibleAge(info['meta']['info_age'])
+            meta = info['meta']
+            response_shard_ids.append(meta['shard_identifier'])
+            self.assertSensibleAge(meta['info_age'])
+
+        self.assertEqual(sorted(shard_ids), sorted(response_shard_ids),
+                         msg='Unexpected or missing shards in response')
 
     def test_query_all_with_unpolled(self):
         """
@@ -88,19 +97,19 @@ class TestInfoServicer(TestCase):
 
         shard_ids = ['shard-1', 'shard-2', 'shard-3']
 
-        for shard_id in shard_ids:
-            ShardPublisher.add_shard(self.make_shard(shard_id))
-        ShardPublisher.add_shard(self.make_shard('not-polled', info=None))
+        ShardPublisher.add_shards(make_shard(shard_id) for shard_id in shard_ids)
+        ShardPublisher.add_shard(make_shard('not-polled', info=None))
 
         response = self.servicer.GetInfos()
 
-        response_shard_ids = [info['meta']['shard_identifier'] for info in response]
-
-        six.assertCountEqual(self, shard_ids, response_shard_ids,
-                             msg='Unexpected or missing shards in response')
-
+        response_shard_ids = []
         for info in response:
-            self.assertSensibleAge(info['meta']['info_age'])
+            meta = info['meta']
+            response_shard_ids.append(meta['shard_identifier'])
+            self.assertSensibleAge(meta['info_age'])
+
+        self.assertEqual(sorted(shard_ids), sorted(response_shard_ids),
+                         msg='Unexpected or missing shards in response')
 
     def test_query_filtering(self):
         shard_id = 'shard-1'
@@ -111,7 +120,7 @@ class TestInfoServicer(TestCase):
             'removed_key2': 'removed',
         }
 
-        ShardPublisher.add_shard(self.make_shard(shard_id, info=info))
+        ShardPublisher.add_shard(make_shard(shard_id, info=info))
 
         resp_info = self.servicer.GetInfos(shard_ids=[shard_id], keys=['dummy_key1', 'dummy_key2'])[0]
 
@@ -131,7 +140,7 @@ class TestInfoServicer(TestCase):
             'removed_key2': 'removed',
         }
 
-        ShardPublisher.add_shard(self.make_shard(shard_id, info=info))
+        ShardPublisher.add_shard(make_shard(shard_id, info=info))
 
         resp_info = self.servicer.GetInfos(shard_ids=[shard_id], keys=['dummy', 'asdf'], prefix_matching=True)[0]
 
@@ -140,18 +149,117 @@ class TestInfoServicer(TestCase):
         # `resp_info` includes the returned INFO fields + an internal-use field called `meta`
         self.assertEqual(len(resp_info), 5, 'Unexpected keys in response ({})'.format(resp_info.keys()))
 
+    def test_query_filtering_overlapping_prefixes(self):
+        shard_id = 'shard-1'
+        info = {
+            'db0': 'dummy',
+            'db1': 'dummy',
+            'dbx': 'dummy',
+            'removed_key1': 'removed',
+        }
+
+        ShardPublisher.add_shard(make_shard(shard_id, info=info))
+
+        resp_info = self.servicer.GetInfos(shard_ids=[shard_id], keys=['db0', 'db', 'dbx'], prefix_matching=True)[0]
+
+        for k in resp_info.keys():
+            self.assertNotIn('removed', k, 'key in response INFO that should have been filtered')
+        # `resp_info` includes the returned INFO fields + an internal-use field called `meta`
+        self.assertEqual(len(resp_info), 4, 'Unexpected keys in response ({})'.format(resp_info.keys()))
+        self.assertEqual(('db', 'removed'), InfoProviderServicer._reduce_prefixes({'db0', 'db', 'dbx', 'removed'}))
+
+    def test_query_filtering_cached(self):
+        shard = make_shard('shard-1', info={'dummy_key1': 'dummy', 'removed_key1': 'removed'})
+        ShardPublisher.add_shard(shard)
+
+        self.servicer.GetInfos(shard_ids=['shard-1'], keys=['dummy_key1'])
+        (cached_info,) = shard._filtered_info_cache.values()
+        self.servicer.GetInfos(shard_ids=['shard-1'], keys=['dummy_key1'])
+        self.assertEqual(1, len(shard._filtered_info_cache))
+        self.assertIs(cached_info, list(shard._filtered_info_cache.values())[0],
+                      'Expected filtered INFO to be reused between polls')
+
+        # updating the shard's INFO (as the poller does) should invalidate the cached result
+        shard.info = dict(shard.info, dummy_key1='updated')
+        resp_info3 = self.servicer.GetInfos(shard_ids=['shard-1'], keys=['dummy_key1'])[0]
+        self.assertEqual('updated', resp_info3['dummy_key1'])
+
+    def test_query_filtering_custom_info_setter(self):
+        class CustomInfoShard(RedisShard):
+            # stores INFO without going through RedisShard.set_info()
+            @property
+            def info(self):
+                return self._custom_info
+
+            @info.setter
+            def info(self, value):
+                self._custom_info = value
+
+        shard = CustomInfoShard('shard-1', None)
+        shard.info = dict(BASE_INFO, dummy_key1='dummy')
+        ShardPublisher.add_shard(shard)
+
+        resp_info = self.servicer.GetInfos(shard_ids=['shard-1'], keys=['dummy_key1'])[0]
+        self.assertEqual('dummy', resp_info['dummy_key1'])
+        shard.info = dict(shard.info, dummy_key1='updated')
+        resp_info = self.servicer.GetInfos(shard_ids=['shard-1'], keys=['dummy_key1'])[0]
+        self.assertEqual('updated', resp_info['dummy_key1'])
+
+    def test_query_filtering_cache_bounded(self):
+        shard = make_shard('shard-1', info={'dummy_key1': 'dummy'})
+        ShardPublisher.add_shard(shard)
+
+        # the shard is never re-polled, so only the size limit keeps distinct filters from accumulating
+        for i in range(10 * InfoProviderServicer.FILTERED_INFO_CACHE_SIZE):
+            self.servicer.GetInfos(shard_ids=['shard-1'], keys=['key{}'.format(i)])
+            self.assertLessEqual(len(shard._filtered_info_cache), InfoProviderServicer.FILTERED_INFO_CACHE_SIZE)
+
+    def test_query_does_not_modify_shard_info(self):
+        shard = make_shard('shard-1', info={'dummy': 'dummy'})
+        ShardPublisher.add_shard(shard)
+
+        original_info = dict(shard.info)
+        for keys in ([], ['dummy']):
+            resp_info = self.servicer.GetInfos(shard_ids=['shard-1'], keys=keys)[0]
+            self.assertIsNot(resp_info, shard.info)
+            self.assertEqual(original_info, shard.info)
+
+    def test_query_preserves_shard_meta(self):
+        shard = make_shard('shard-1', info={'dummy': 'dummy', 'meta': {'custom': 'value'}})
+        ShardPublisher.add_shard(shard)
+
+        for keys, prefix_matching in (([], False), (['dummy'], False), (['dum'], True)):
+            meta = self.servicer.GetInfos(shard_ids=['shard-1'], keys=keys, prefix_matching=prefix_matching)[0]['meta']
+            self.assertEqual('value', meta['custom'])
+            self.assertEqual('shard-1', meta['shard_identifier'])
+            self.assertSensibleAge(meta['info_age'])
+        self.assertEqual({'custom': 'value'}, shard.info['meta'])
+
     def test_query_missing(self):
         shard_ids = ['shard-1', 'shard-2']
 
-        for shard_id in shard_ids:
-            ShardPublisher.add_shard(self.make_shard(shard_id))
+        ShardPublisher.add_shards(make_shard(shard_id) for shard_id in shard_ids)
 
         with self.assertRaises(KeyError):
             self.servicer.GetInfos(shard_ids=['shard-x'])
 
+    def test_query_missing_among_existing(self):
+        ShardPublisher.add_shard(make_shard('shard-1'))
+
+        # the first unknown shard in request order is reported
+        with self.assertRaises(KeyError) as cm:
+            self.servicer.GetInfos(shard_ids=['shard-1', 'shard-y', 'shard-x'])
+        self.assertErrorMatches(cm.exception.args[0], re.compile(r'shard shard-y not found'))
+
+        # unknown shards are reported ahead of ones whose INFO is not yet available
+        ShardPublisher.add_shard(make_shard('unpolled', info=None))
+        with self.assertRaises(KeyError) as cm:
+            self.servicer.GetInfos(shard_ids=['unpolled', 'shard-x'])
+        self.assertErrorMatches(cm.exception.args[0], re.compile(r'shard shard-x not found'))
+
     def test_allow_partial_missing_info(self):
-        ShardPublisher.add_shard(self.make_shard('shard-1', info={'dummy': 'dummy'}))
-        ShardPublisher.add_shard(self.make_shard('shard-2', info=None))
+        ShardPublisher.add_shard(make_shard('shard-1', info={'dummy': 'dummy'}))
+        ShardPublisher.add_shard(make_shard('shard-2', info=None))
 
         response = self.servicer.GetInfos(shard_ids=['shard-1', 'shard-2'], allow_partial=True)
         response_dict = {info['meta']['shard_identifier']: info for info in response}
@@ -159,10 +267,10 @@ class TestInfoServicer(TestCase):
         self.assertIn('dummy', response_dict['shard-1'])
         self.assertGreater(response_dict['shard-2']['meta']['info_age'], self.CENTURY_IN_SEC,
                            msg='Expected info_age for shard-2 to be very large')
-        six.assertRegex(self, response_dict['shard-2']['meta']['error'], 'info for shard .* not available')
+        self.assertErrorMatches(response_dict['shard-2']['meta']['error'], INFO_UNAVAILABLE_RE)
 
     def test_allow_partial_unknown_shard(self):
-        ShardPublisher.add_shard(self.make_shard('shard-1', info={'dummy': 'dummy'}))
+        ShardPublisher.add_shard(make_shard('shard-1', info={'dummy': 'dummy'}))
 
         response = self.servicer.GetInfos(shard_ids=['shard-1', 'shard-2'], allow_partial=True)
         response_dict = {info['meta']['shard_identifier']: info for info in response}
@@ -170,11 +278,11 @@ class TestInfoServicer(TestCase):
         self.assertIn('dummy', response_dict['shard-1'])
         self.assertGreater(response_dict['shard-2']['meta']['info_age'], self.CENTURY_IN_SEC,
                            msg='Expected info_age for shard-2 to be very large')
-        six.assertRegex(self, response_dict['shard-2']['meta']['error'], 'shard .* not found')
+        self.assertErrorMatches(response_dict['shard-2']['meta']['error'], SHARD_NOT_FOUND_RE)
 
     def test_backwards_compatibility(self):
-        ShardPublisher.add_shard(self.make_shard('shard-1', info={'dummy1': 'dummy1', 'dummy2': 'dummy2'}))
-        ShardPublisher.add_shard(self.make_shard('shard-2', info={'dummy1': 'dummy1'}))
+        ShardPublisher.add_shard(make_shard('shard-1', info={'dummy1': 'dummy1', 'dummy2': 'dummy2'}))
+        ShardPublisher.add_shard(make_shard('shard-2', info={'dummy1': 'dummy1'}))
 
         response = self.servicer.GetInfos(shard_ids=['shard-1', 'shard-2'], key_patterns=['dummy1'])
         response_dict = {info['meta']['shard_identifier']: info for info in response}
@@ -184,13 +292,25 @@ class TestInfoServicer(TestCase):
         with self.assertRaises(TypeError):
             self.servicer.GetInfos(shard_ids=['shard-1'], key_patterns=['dummy1'], keys=['dummy1'])
 
-    @patch('redis_info_provider.info_servicer.time.time')
-    def test_max_age(self, time_mock):
+    def test_max_age(self):
         now = 1545240843.4637716
-        ShardPublisher.add_shard(self.make_shard('shard-1', info={'dummy': 'dummy'}, info_timestamp=now))
-        time_mock.return_value = now + 4.0
+        ShardPublisher.add_shard(make_shard('shard-1', info={'dummy': 'dummy'}, info_timestamp=now))
+        # a plain attribute swap is all that's needed to fix the servicer's clock
+        self.addCleanup(setattr, info_servicer, 'time', info_servicer.time)
+        info_servicer.time = lambda: now + 4.0
         response = self.servicer.GetInfos(max_age=5.0)
         self.assertEqual(len(response), 1)
-        time_mock.return_value = now + 6.0
+        info_servicer.time = lambda: now + 6.0
         response = self.servicer.GetInfos(max_age=5.0)
         self.assertEqual(len(response), 0)
+
+    @patch('redis_info_provider.info_servicer.time')
+    def test_consistent_age(self, time_mock):
+        now = 1545240843.4637716
+        ShardPublisher.add_shard(make_shard('shard-1', info={'dummy': 'dummy'}, info_timestamp=now - 1.0))
+        ShardPublisher.add_shard(make_shard('shard-2', info={'dummy': 'dummy'}, info_timestamp=now - 2.0))
+        time_mock.return_value = now
+        response = self.servicer.GetInfos(shard_ids=['shard-1', 'shard-2'])
+        # all shards in a response are aged against a single reading of the clock
+        self.assertEqual(1, time_mock.call_count)
+        self.assertEqual([1.0, 2.0], [info['meta']['info_age'] for info in response])
@@ -1,43 +1,61 @@
 from unittest import TestCase
-from redis_info_provider.shard_pub import ShardPublisher, _ShardPublisher
+from redis_info_provider.shard_pub import ShardPublisher
 from redis_info_provider.redis_shard import RedisShard
-import six
+
+
+def make_dummy_shard(id):
+    return RedisShard(id, {})
 
 
 class TestShardPublisher(TestCase):
     def tearDown(self):
-        # recreate the global instance to reset state between tests
-        global ShardPublisher
-        ShardPublisher = _ShardPublisher()
+        # reset the global instance in place, so no shards or subscribers leak into other tests
+        ShardPublisher._reset_state()
         super(TestShardPublisher, self).tearDown()
 
-    @staticmethod
-    def make_dummy_shard(id):
-        return RedisShard(id, {})
-
     def test_shard_tracking(self):
-        s1 = self.make_dummy_shard(1)
-        s2 = self.make_dummy_shard(2)
+        s1 = make_dummy_shard(1)
+        s2 = make_dummy_shard(2)
         shards = [s1, s2]
 
         ShardPublisher.add_shard(s1)
         ShardPublisher.add_shard(s2)
 
-        six.assertCountEqual(self, shards, ShardPublisher.get_live_shards())
-        six.assertCountEqual(self, [s.id for s in shards], ShardPublisher.get_live_shard_ids())
+        # the publisher tracks shards by id, so there are no duplicates for set comparison to overlook
+        self.assertEqual(set(shards), set(ShardPublisher.get_live_shards()))
+        self.assertEqual({s.id for s in shards}, ShardPublisher.get_live_shard_ids())
 
         ShardPublisher.del_shard(s1.id)
 
-        six.assertCountEqual(self, shards[-1:], ShardPublisher.get_live_shards())
-        six.assertCountEqual(self, [s.id for s in shards[-1:]], ShardPublisher.get_live_shard_ids())
+        self.assertEqual(set(shards[-1:]), set(ShardPublisher.get_live_shards()))
+        self.assertEqual({s.id for s in shards[-1:]}, ShardPublisher.get_live_shard_ids())
+
+    def test_live_shards_snapshot(self):
+        s1 = make_dummy_shard(1)
+        s2 = make_dummy_shard(2)
+
+        ShardPublisher.add_shard(s1)
+        live_shards = ShardPublisher.get_live_shards()
+        live_shard_ids = ShardPublisher.get_live_shard_ids()
+        self.assertIs(live_shards, ShardPublisher.get_live_shards())
+        self.assertIs(live_shard_ids, ShardPublisher.get_live_shard_ids())
+
+        # the snapshots must be refreshed once the set of shards changes
+        ShardPublisher.add_shard(s2)
+        self.assertEqual({s1, s2}, set(ShardPublisher.get_live_shards()))
+        self.assertEqual({s1.id, s2.id}, ShardPublisher.get_live_shard_ids())
+        self.assertEqual((s1,), live_shards)
+        self.assertEqual({s1.id}, live_shard_ids)
 
     def test_get_shard(self):
-        s = self.make_dummy_shard(5)
+        s = make_dummy_shard(5)
         ShardPublisher.add_shard(s)
         self.assertEqual(s, ShardPublisher.get_shard(s.id))
+        self.assertEqual(s, ShardPublisher.try_get_shard(s.id))
+        self.assertIsNone(ShardPublisher.try_get_shard('no-such-shard'))
 
     def test_subscribe_shard_event(self):
-        s = self.make_dummy_shard(5)
+        s = make_dummy_shard(5)
 
         notify_add = NotificationTracker()
         ShardPublisher.subscribe_shard_event(ShardPublisher.ShardEvent.ADDED, notify_add.notify)
@@ -52,7 +70,7 @@ class TestShardPublisher(TestCase):
         self.assertEqual(1, notify_del.times_notified)
 
     def test_unsub_shard_event(self):
-        s = self.make_dummy_shard(5)
+        s = make_dummy_shard(5)
 
         notify = NotificationTracker()
         ShardPublisher.subscribe_shard_event(ShardPublisher.ShardEvent.ADDED, notify.notify)
@@ -65,8 +83,47 @@ class TestShardPublisher(TestCase):
         ShardPublisher.del_shard(s.id)
         self.assertEqual(1, notify.times_notified)
 
+    def test_add_shards(self):
+        shards = [make_dummy_shard(i) for i in range(3)]
+
+        notify = NotificationTracker()
+        ShardPublisher.subscribe_shard_event(ShardPublisher.ShardEvent.ADDED, notify.notify)
+        ShardPublisher.add_shards(shards)
+
+        self.assertEqual(set(shards), set(ShardPublisher.get_live_shards()))
+        self.assertEqual(len(shards), notify.times_notified)
+
+    def test_unsub_during_notification(self):
+        s = make_dummy_shard(5)
+
+        notify = NotificationTracker()
+
+        def unsub_self(_):
+            ShardPublisher.unsub_shard_event(ShardPublisher.ShardEvent.ADDED, unsub_self)
+
+        ShardPublisher.subscribe_shard_event(ShardPublisher.ShardEvent.ADDED, unsub_self)
+        ShardPublisher.subscribe_shard_event(ShardPublisher.ShardEvent.ADDED, notify.notify)
+        ShardPublisher.add_shard(s)
+        self.assertEqual(1, notify.times_notified)
+
+    def test_isolated_state(self):
+        s1 = make_dummy_shard(1)
+        s2 = make_dummy_shard(2)
+        notify = NotificationTracker()
+
+        ShardPublisher.add_shard(s1)
+        ShardPublisher.subscribe_shard_event(ShardPublisher.ShardEvent.ADDED, notify.notify)
+        with ShardPublisher.isolated_state():
+            self.assertEqual(0, len(ShardPublisher.get_live_shards()))
+            ShardPublisher.add_shard(s2)
+            self.assertEqual(0, notify.times_notified)
+
+        self.assertEqual({s1.id}, ShardPublisher.get_live_shard_ids())
+        ShardPublisher.add_shard(s2)
+        self.assertEqual(1, notify.times_notified)
+
     def test_clear_shards(self):
-        shards = [self.make_dummy_shard(i) for i in range(2)]
+        shards = [make_dummy_shard(i) for i in range(2)]
         for shard in shards:
             ShardPublisher.add_shard(shard)
         ShardPublisher.clear_shards()